@@ -77,6 +77,20 @@ class MESH_OT_maze_mesh(bpy.types.Operator):
         ("2", "None", "Boundary wall is not extruded", 2)
     )
 
+    weight_types = (
+        ("NONE", "None", "Carve every direction equally", 0),
+        ("VERTEX_GROUP", "Vertex Group", "Weight from a vertex group", 1),
+        ("ATTRIBUTE", "Attribute", "Weight from a float edge or vertex attribute", 2),
+        ("DIRECTION", "Direction", "Weight from edge alignment with an axis", 3),
+        ("ANGLE", "Angle", "Weight from angle between edge faces", 4)
+    )
+
+    weight_axes = (
+        ("0", "X", "Follow the X axis", 0),
+        ("1", "Y", "Follow the Y axis", 1),
+        ("2", "Z", "Follow the Z axis", 2)
+    )
+
     offset_type: bpy.props.EnumProperty(
         name='Bevel Amount Type',
         description="What distance Width measures",
@@ -144,6 +158,42 @@ class MESH_OT_maze_mesh(bpy.types.Operator):
         default=0, min=0.0, max=1.0, precision=2,
         update=update_maze)
 
+    cell_size: bpy.props.FloatProperty(
+        name='Cell Size',
+        description='carve maze on clusters of verts this size, 0 uses every vert',
+        default=0.0, min=0.0, soft_max=10.0, precision=3,
+        update=update_maze)
+
+    weight_type: bpy.props.EnumProperty(
+        name='Weight Type',
+        description="what biases the direction of the maze path",
+        items=weight_types, default="NONE",
+        update=update_maze)
+
+    weight_name: bpy.props.StringProperty(
+        name='Weight Name',
+        description='vertex group or attribute to weight the maze path',
+        default='',
+        update=update_maze)
+
+    weight_axis: bpy.props.EnumProperty(
+        name='Weight Axis',
+        description="axis for the maze path to follow",
+        items=weight_axes, default="2",
+        update=update_maze)
+
+    weight_bias: bpy.props.FloatProperty(
+        name='Weight Bias',
+        description='how strongly the maze path follows the weight, negative avoids it',
+        default=2.0, min=-50.0, max=50.0,
+        soft_min=-10.0, soft_max=10.0, precision=2,
+        update=update_maze)
+
+    carve_order: bpy.props.BoolProperty(
+        name='Carve Order',
+        description='store the order the maze path was carved in a carve_order attribute',
+        default=False)
+
     boundary_type: bpy.props.EnumProperty(
         name='Boundary Wall Type',
         description="type of wall on boundary of maze",
@@ -167,8 +217,21 @@ class MESH_OT_maze_mesh(bpy.types.Operator):
         box_maze.label(text='Maze Parameters')
         box_maze.prop(self, 'rseed')
         box_maze.prop(self, 'braid')
+        box_maze.prop(self, 'cell_size')
+        box_maze.prop(self, 'weight_type')
+        if self.weight_type == 'VERTEX_GROUP':
+            box_maze.prop_search(self, 'weight_name',
+                                 context.object, 'vertex_groups')
+        elif self.weight_type == 'ATTRIBUTE':
+            box_maze.prop(self, 'weight_name')
+        elif self.weight_type == 'DIRECTION':
+            box_maze.prop(self, 'weight_axis')
+        if self.weight_type != 'NONE':
+            box_maze.prop(self, 'weight_bias')
         box_maze.prop(self, 'boundary_type')
         box_maze.prop(self, 'options')
+        if self.options:
+            box_maze.prop(self, 'carve_order')
 
         box_path = layout.box()
         box_path.label(text='Path Paramters')
@@ -207,6 +270,13 @@ class MESH_OT_maze_mesh(bpy.types.Operator):
         maze_params['use_outset'] = self.use_outset
         maze_params['use_relative_offset'] = self.use_relative_offset
         maze_params['braid'] = self.braid
+        maze_params['carve_order'] = self.carve_order
+        maze_params['cell_size'] = self.cell_size
+        maze_params['weight_type'] = self.weight_type
+        maze_params['weight_group'] = -1
+        maze_params['weight_name'] = self.weight_name
+        maze_params['weight_axis'] = int(self.weight_axis)
+        maze_params['weight_bias'] = self.weight_bias
 
         return maze_params
 
@@ -227,6 +297,18 @@ class MESH_OT_maze_mesh(bpy.types.Operator):
             self.update = True
 
         maze_params = self.get_maze_params()
+        vertex_group = obj.vertex_groups.get(self.weight_name)
+        if vertex_group is not None:
+            maze_params['weight_group'] = vertex_group.index
+        elif self.weight_type == 'VERTEX_GROUP':
+            self.report({'WARNING'},
+                "Vertex group '%s' not found. Maze is not weighted" % self.weight_name)
+        if (self.weight_type == 'ATTRIBUTE'
+                and bm.edges.layers.float.get(self.weight_name) is None
+                and bm.verts.layers.float.get(self.weight_name) is None):
+            self.report({'WARNING'},
+                "Float attribute '%s' not found on edges or vertices. "
+                "Maze is not weighted" % self.weight_name)
         bpy.ops.mesh.select_mode(type='EDGE')
     
         bm, self.link_centers, self.vert_centers = mesh_maze.generate_maze(bm, maze_params)
@@ -9,6 +9,7 @@ should be standalone and able to run with a profiler or against unit tests
 
 """
 
+import math
 import random
 import bmesh
 import mathutils
@@ -29,6 +30,13 @@ MAZE_PARAMS['use_even_offset'] = False
 MAZE_PARAMS['use_outset'] = False
 MAZE_PARAMS['use_relative_offset'] = False
 MAZE_PARAMS['braid'] = 0.0
+MAZE_PARAMS['carve_order'] = False
+MAZE_PARAMS['cell_size'] = 0.0
+MAZE_PARAMS['weight_type'] = "NONE"
+MAZE_PARAMS['weight_group'] = -1
+MAZE_PARAMS['weight_name'] = ""
+MAZE_PARAMS['weight_axis'] = 2
+MAZE_PARAMS['weight_bias'] = 2.0
 
 
 def generate_maze(bm, maze_params):
@@ -42,7 +50,14 @@ def generate_maze(bm, maze_params):
         all_edges = sorted(bm.edges, key=lambda edge: edge.index)
         full_mesh = inner_edges == all_edges
         random.seed(maze_params['rseed'])
-        maze_path, maze_verts = recursive_back_tracker_maze(inner_edges, full_mesh)
+        if maze_params['cell_size'] > 0.0:
+            maze_path, maze_verts = hierarchical_maze(inner_edges,
+                                                      maze_params['cell_size'])
+        elif maze_params['weight_type'] != "NONE":
+            weights = get_edge_weights(bm, inner_edges, maze_params)
+            maze_path, maze_verts = weighted_kruskal_maze(inner_edges, weights)
+        else:
+            maze_path, maze_verts = recursive_back_tracker_maze(inner_edges, full_mesh)
         if maze_params['braid'] > 0.0:
             maze_path = do_braid(maze_path, maze_verts, maze_params['braid'])
 
@@ -104,43 +119,363 @@ def recursive_back_tracker_maze(bm_edges, full_mesh=False):
         maze_path: list of BMEdges
         maze_verts: list of BMVerts
     """
-    stack = []
     maze_path = []
     maze_verts = []
+    for step, link_edge, vert in recursive_back_tracker_steps(bm_edges, full_mesh):
+        if step == 'LINK':
+            maze_path.append(link_edge)
+        if step != 'BACKTRACK':
+            maze_verts.append(vert)
+
+    return maze_path, maze_verts
+
+
+def recursive_back_tracker_steps(bm_edges, full_mesh=False):
+    """generator version of recursive_back_tracker_maze that yields each step
+    of the carve as it happens, for animating maze growth
+    input:
+        bm_edges: list of BMEdges - needs to be pre-sorted on index
+        full_mesh: does bm_edges include the whole mesh
+    yields:
+        see back_tracker_steps, links are BMEdges and nodes are BMVerts
+    """
+    edge_set = set(bm_edges)
+
+    def vert_links(vert):
+        """ (edge, other vert) for each edge of vert in the maze"""
+        if full_mesh:
+            # faster if we don't check edge is in bm_edges
+            return [(e, e.other_vert(vert)) for e in vert.link_edges]
+        return [(e, e.other_vert(vert)) for e in vert.link_edges if e in edge_set]
+
     # start at a random vert in maze
     start_vert = random.choice(bm_edges).verts[0]
-    stack.append(start_vert)
-    maze_verts.append(start_vert)
+    yield from back_tracker_steps(start_vert, vert_links)
+
+
+def back_tracker_steps(start_node, node_links):
+    """recursive back tracker over any graph, yields each step of the carve
+    as it happens. Used for both mesh verts and coarse cells.
+    input:
+        start_node: node to start the maze from
+        node_links: function returning a list of (link, other node) for
+            every neighbour of a node
+    yields:
+        (step, link, node) where step is
+        'START' - node is the first node of the maze, link is None
+        'LINK' - link is carved, node is the newly reached node
+        'BACKTRACK' - node is a dead end popped off the stack, link is None
+    """
+    stack = [start_node]
+    visited = {start_node}
+    yield 'START', None, start_node
     while len(stack) > 0:
-        current_vert = stack[-1]
-        if full_mesh:
-            # faster if we don't check edge is in bm_edges
-            free_link_edges = [
-                e
-                for e in current_vert.link_edges
-                if (e.other_vert(current_vert) not in maze_verts)
-            ]
-        else:
-            # check edge in bm_edge
-            free_link_edges = [
-                e
-                for e in current_vert.link_edges
-                if (e in bm_edges)
-                and (e.other_vert(current_vert) not in maze_verts)
-            ]
+        current_node = stack[-1]
+        free_links = [
+            (link, node)
+            for link, node in node_links(current_node)
+            if node not in visited
+        ]
 
-        if len(free_link_edges) == 0:
+        if len(free_links) == 0:
             stack.pop()
+            yield 'BACKTRACK', None, current_node
         else:
-            link_edge = random.choice(free_link_edges)
-            maze_path.append(link_edge)
-            new_vert = link_edge.other_vert(current_vert)
-            stack.append(new_vert)
-            maze_verts.append(new_vert)
+            link, new_node = random.choice(free_links)
+            stack.append(new_node)
+            visited.add(new_node)
+            yield 'LINK', link, new_node
+
+
+def set_carve_order(bm, maze_path, layer_name='carve_order'):
+    """write the position of each edge in maze_path to an integer edge layer
+    so the growth of the maze can be revealed over time by drivers or
+    geometry nodes. Edges not in the maze get -1.
+    Only the carved links are recorded, use recursive_back_tracker_steps
+    to also follow the backtracks.
+    inputs:
+        bm: the bmesh for the whole mesh
+        maze_path: list of BMEdges in the order they were carved
+        layer_name: name of the integer edge layer, created if needed
+    output:
+        the BMLayerItem written to
+    """
+    layer = bm.edges.layers.int.get(layer_name)
+    if layer is None:
+        layer = bm.edges.layers.int.new(layer_name)
+    carve_order = {edge: i for i, edge in enumerate(maze_path)}
+    for edge in bm.edges:
+        edge[layer] = carve_order.get(edge, -1)
+    return layer
+
+
+def set_face_carve_order(bm, link_faces, path_faces, layer_name='carve_order'):
+    """face version of set_carve_order for a bevelled maze
+    inputs:
+        bm: the bmesh for the whole mesh
+        link_faces: list of BMFaces of the maze links in the order they were carved
+        path_faces: list of all BMFaces in the path
+        layer_name: name of the integer face layer, created if needed
+    output:
+        the BMLayerItem written to
+    each link face gets its position in link_faces, the other path faces
+    take the position of the first link face they share an edge with
+    and wall faces get -1
+    """
+    layer = bm.faces.layers.int.get(layer_name)
+    if layer is None:
+        layer = bm.faces.layers.int.new(layer_name)
+    carve_order = {}
+    for i, face in enumerate(link_faces):
+        carve_order.setdefault(face, i)
+    path_set = set(path_faces)
+    for face in bm.faces:
+        if face in carve_order:
+            face[layer] = carve_order[face]
+        elif face in path_set:
+            face[layer] = min(
+                (carve_order[f]
+                 for e in face.edges
+                 for f in e.link_faces
+                 if f in carve_order),
+                default=0)
+        else:
+            face[layer] = -1
+    return layer
+
+
+def hierarchical_maze(bm_edges, cell_size):
+    """trace a perfect maze on a coarse graph of vertex clusters and project
+    it back onto chains of bm_edges, so the maze scale is set by cell_size
+    rather than the mesh resolution. Falls back to recursive_back_tracker_maze
+    if cell_size is so large that every vert is in one cluster
+    input:
+        bm_edges: list of BMEdges - needs to be pre-sorted on index
+        cell_size: edge length of the spatial hash cells used to cluster verts
+    output:
+        maze_path: list of BMEdges
+        maze_verts: list of BMVerts
+    """
+    clusters, vert_cluster, parent_edges = get_vert_clusters(bm_edges, cell_size)
+    if len(clusters) < 2:
+        return recursive_back_tracker_maze(bm_edges)
+
+    # edges of bm_edges that cross between each pair of neighbouring clusters
+    crossings = {}
+    for edge in bm_edges:
+        id_0, id_1 = (vert_cluster[v] for v in edge.verts)
+        if id_0 != id_1:
+            crossings.setdefault((min(id_0, id_1), max(id_0, id_1)), []).append(edge)
+
+    cell_nghbrs = {i: [] for i in range(len(clusters))}
+    for id_0, id_1 in crossings:
+        cell_nghbrs[id_0].append(id_1)
+        cell_nghbrs[id_1].append(id_0)
+
+    cell_path = []
+    for step, link, cell in recursive_back_tracker_cells(cell_nghbrs):
+        if step == 'START':
+            start_cell = cell
+        elif step == 'LINK':
+            cell_path.append(link)
+
+    # follow the shortest path trees from each crossing edge back to the
+    # representative vert of both clusters, the union of these is a tree
+    maze_path = []
+    maze_verts = [clusters[start_cell][0]]
+    path_set = set()
+    vert_set = set(maze_verts)
+    for id_0, id_1 in cell_path:
+        link_edge = random.choice(crossings[(min(id_0, id_1), max(id_0, id_1))])
+        maze_path.append(link_edge)
+        path_set.add(link_edge)
+        for vert in link_edge.verts:
+            if vert not in vert_set:
+                vert_set.add(vert)
+                maze_verts.append(vert)
+            edge = parent_edges[vert]
+            while edge is not None and edge not in path_set:
+                maze_path.append(edge)
+                path_set.add(edge)
+                vert = edge.other_vert(vert)
+                if vert not in vert_set:
+                    vert_set.add(vert)
+                    maze_verts.append(vert)
+                edge = parent_edges[vert]
 
     return maze_path, maze_verts
 
 
+def get_vert_clusters(bm_edges, cell_size):
+    """group the verts of bm_edges into connected clusters that share a
+    spatial hash cell
+    input:
+        bm_edges: list of BMEdges - needs to be pre-sorted on index
+        cell_size: edge length of the spatial hash cells
+    output:
+        clusters: list of lists of BMVerts, the first vert in each is the
+            representative vert nearest the cluster center
+        vert_cluster: dict of BMVert: index into clusters
+        parent_edges: dict of BMVert: BMEdge on the shortest path to the
+            representative vert of its cluster, None for the representative
+    """
+    vert_edges = {}
+    for edge in bm_edges:
+        for vert in edge.verts:
+            vert_edges.setdefault(vert, []).append(edge)
+    # hash cells start at the lowest corner of the verts so a cell_size
+    # covering the whole selection gives a single cell
+    min_co = [min(co) for co in zip(*(vert.co for vert in vert_edges))]
+    cell_keys = {
+        vert: tuple(math.floor((co - co_0) / cell_size)
+                    for co, co_0 in zip(vert.co, min_co))
+        for vert in vert_edges
+    }
+
+    clusters = []
+    vert_cluster = {}
+    parent_edges = {}
+    for seed_vert in sorted(vert_edges, key=lambda vert: vert.index):
+        if seed_vert in vert_cluster:
+            continue
+        # flood fill the cell from seed_vert
+        cluster_id = len(clusters)
+        cluster = [seed_vert]
+        vert_cluster[seed_vert] = cluster_id
+        for vert in cluster:
+            for edge in vert_edges[vert]:
+                other = edge.other_vert(vert)
+                if (other not in vert_cluster
+                        and cell_keys[other] == cell_keys[seed_vert]):
+                    vert_cluster[other] = cluster_id
+                    cluster.append(other)
+
+        # breadth first shortest path tree from the vert nearest the center
+        center = sum((vert.co for vert in cluster), mathutils.Vector()) / len(cluster)
+        root = min(cluster, key=lambda vert: (vert.co - center).length)
+        parent_edges[root] = None
+        tree = [root]
+        for vert in tree:
+            for edge in vert_edges[vert]:
+                other = edge.other_vert(vert)
+                if (vert_cluster.get(other) == cluster_id
+                        and other not in parent_edges):
+                    parent_edges[other] = edge
+                    tree.append(other)
+        clusters.append(tree)
+
+    return clusters, vert_cluster, parent_edges
+
+
+def recursive_back_tracker_cells(cell_nghbrs):
+    """generator version of the recursive back tracker on a graph of cells
+    input:
+        cell_nghbrs: dict of cell id: list of neighbouring cell ids
+    yields:
+        see back_tracker_steps, links are (cell id, cell id) tuples and
+        nodes are cell ids
+    """
+    start_cell = random.choice(sorted(cell_nghbrs))
+    yield from back_tracker_steps(
+        start_cell,
+        lambda cell: [((cell, other), other) for other in cell_nghbrs[cell]])
+
+
+def get_edge_weights(bm, bm_edges, maze_params):
+    """precompute a carving weight for each edge in bm_edges in one pass
+    inputs:
+        bm: the bmesh for the whole mesh
+        bm_edges: list of BMEdges
+        maze_params: uses weight_type, weight_group, weight_name,
+            weight_axis and weight_bias
+    output:
+        weights: list of floats > 0, one per edge in bm_edges
+    weight_type picks a value between 0 and 1 for each edge
+        VERTEX_GROUP - mean vertex group weight of the edge verts
+        ATTRIBUTE - float edge attribute or mean float vert attribute
+        DIRECTION - alignment of the edge with weight_axis
+        ANGLE - dihedral angle between the edge faces
+    the weight is exp(weight_bias * value) so a positive bias makes the
+    maze follow high values and a negative bias avoids them.
+    weight_bias is clamped between -50 and 50 so the weights stay finite
+    and positive
+    """
+    weight_type = maze_params['weight_type']
+    values = [0.0] * len(bm_edges)
+    if weight_type == "VERTEX_GROUP":
+        deform = bm.verts.layers.deform.active
+        group = maze_params['weight_group']
+        if deform is not None and group >= 0:
+            values = [
+                (e.verts[0][deform].get(group, 0.0)
+                 + e.verts[1][deform].get(group, 0.0)) / 2
+                for e in bm_edges
+            ]
+    elif weight_type == "ATTRIBUTE":
+        edge_layer = bm.edges.layers.float.get(maze_params['weight_name'])
+        vert_layer = bm.verts.layers.float.get(maze_params['weight_name'])
+        if edge_layer is not None:
+            values = [e[edge_layer] for e in bm_edges]
+        elif vert_layer is not None:
+            values = [
+                (e.verts[0][vert_layer] + e.verts[1][vert_layer]) / 2
+                for e in bm_edges
+            ]
+        values = [min(max(value, 0.0), 1.0) for value in values]
+    elif weight_type == "DIRECTION":
+        axis = maze_params['weight_axis']
+        values = [
+            abs((e.verts[1].co - e.verts[0].co).normalized()[axis])
+            for e in bm_edges
+        ]
+    elif weight_type == "ANGLE":
+        values = [e.calc_face_angle(0.0) / math.pi for e in bm_edges]
+
+    bias = min(max(maze_params['weight_bias'], -50.0), 50.0)
+    return [math.exp(bias * value) for value in values]
+
+
+def weighted_kruskal_maze(bm_edges, weights):
+    """trace a perfect maze through bm_edges with Kruskal's algorithm,
+    edges with a higher weight are more likely to be carved
+    input:
+        bm_edges: list of BMEdges - needs to be pre-sorted on index
+        weights: list of floats > 0, one per edge in bm_edges
+    output:
+        maze_path: list of BMEdges
+        maze_verts: list of BMVerts
+    """
+    # weighted random order of all edges in a single sort, each edge gets
+    # an exponential key with rate w so higher weights tend to come first.
+    # Unlike u ** (1 / w) this does not underflow to 0 for small weights
+    keys = [random.expovariate(w) for w in weights]
+    order = sorted(range(len(bm_edges)), key=lambda i: keys[i])
+
+    parents = {}
+    maze_path = []
+    for i in order:
+        edge = bm_edges[i]
+        root_0 = find_root(parents, edge.verts[0])
+        root_1 = find_root(parents, edge.verts[1])
+        if root_0 != root_1:
+            parents[root_0] = root_1
+            maze_path.append(edge)
+
+    maze_verts = sorted({v for e in bm_edges for v in e.verts},
+                        key=lambda vert: vert.index)
+    return maze_path, maze_verts
+
+
+def find_root(parents, vert):
+    """ find the root of the tree vert belongs to in the disjoint set forest
+    parents, halving the path on the way"""
+    parents.setdefault(vert, vert)
+    while parents[vert] != vert:
+        parents[vert] = parents[parents[vert]]
+        vert = parents[vert]
+    return vert
+
+
 def get_maze_centers(maze_path, maze_verts):
     """find the centre of each edge in maze_path and the co-ordinates of the
     maze verts - these will be matched to face after the selection is bevelled
@@ -183,12 +518,17 @@ def bevel_extrude(bm, sel_geom, maze_params, link_centers, vert_centers):
             clamp_overlap=maze_params['use_clamp_overlap'],
             material=-1)
 
-        path_faces, wall_faces = get_maze_faces(bm, bevel_faces['faces'],
-                                                link_centers + vert_centers,
-                                                maze_params['boundary_type'])
+        path_faces, wall_faces, center_faces = get_maze_faces(
+            bm, bevel_faces['faces'],
+            link_centers + vert_centers,
+            maze_params['boundary_type'])
         for face in path_faces:
             face.select = True
 
+        if maze_params['carve_order']:
+            link_faces = center_faces[:len(link_centers)]
+            set_face_carve_order(bm, link_faces, path_faces)
+
         if abs(maze_params['depth']) > 0.001:
             bmesh.ops.inset_region(
                 bm,
@@ -205,6 +545,9 @@ def bevel_extrude(bm, sel_geom, maze_params, link_centers, vert_centers):
         for edge in path_edges:
             edge.select = True
 
+        if maze_params['carve_order']:
+            set_carve_order(bm, path_edges)
+
 
 def get_maze_faces(bm, bevel_faces, maze_centers, boundary_type):
     """find which of the faces in bm  are in the path and which are in the wall
@@ -216,48 +559,67 @@ def get_maze_faces(bm, bevel_faces, maze_centers, boundary_type):
     ouputs:
         path_faces: list of faces that make up the path
         wall_faces: list of faces that make up the wall
+        center_faces: list of the path face nearest each of maze_centers
     """
-    # find center of each face in new bevel mesh faces
-    face_centers = [f.calc_center_median() for f in bevel_faces]
-    fc_tree = mathutils.kdtree.KDTree(len(face_centers))
-    for i, center in enumerate(face_centers):
-        fc_tree.insert(center, i)
-    fc_tree.balance()
-    path_face_ids = [fc_tree.find(v)[1] for v in maze_centers]
-    path_faces = list({bevel_faces[id] for id in path_face_ids})
-
-    # the selection of differnt boundary wall types works
-    # but code seems clumsy
-    wall_geom = bmesh.ops.region_extend(
-        bm, geom=path_faces,
-        use_faces=True,
-        use_face_step=True,
-        use_contract=False)
+    center_faces = get_near_faces(bevel_faces, maze_centers)
+    path_faces = list(set(center_faces))
+
+    # one pass over the faces around the path labels the thin wall, faces
+    # sharing a vert with the path that are not path themselves
+    path_set = set(path_faces)
+    thin_wall = []
+    thin_wall_set = set()
+    for face in path_faces:
+        for vert in face.verts:
+            for link_face in vert.link_faces:
+                if link_face not in path_set and link_face not in thin_wall_set:
+                    thin_wall_set.add(link_face)
+                    thin_wall.append(link_face)
 
-    thin_wall = wall_geom['geom']
     if boundary_type == 1:
         wall_faces = thin_wall
     elif boundary_type == 0:
-        wall_faces = set(bevel_faces + thin_wall) - set(path_faces)
-    elif boundary_type == 2:
-        test_geom = bmesh.ops.region_extend(
-            bm,
-            geom=thin_wall + path_faces,
-            use_faces=True,
-            use_face_step=True,
-            use_contract=True)
-
-        boundary_faces = [
+        # thick boundary wall is everything in the bevel that is not path
+        wall_faces = thin_wall + [
             f
-            for f in thin_wall
-            for v in f.verts
-            if v.is_boundary
+            for f in bevel_faces
+            if f not in path_set and f not in thin_wall_set
         ]
-        wall_faces = (set(thin_wall)
-                      - set(test_geom['geom'])
-                      - set(boundary_faces))
-
-    return path_faces, list(wall_faces)
+    elif boundary_type == 2:
+        # internal wall faces only touch verts that are off the mesh boundary
+        # and surrounded by path or thin wall faces
+        vert_inside = {}
+        wall_faces = []
+        for face in thin_wall:
+            for vert in face.verts:
+                if vert not in vert_inside:
+                    vert_inside[vert] = (not vert.is_boundary) and all(
+                        f in path_set or f in thin_wall_set
+                        for f in vert.link_faces)
+                if not vert_inside[vert]:
+                    break
+            else:
+                wall_faces.append(face)
+
+    return path_faces, wall_faces, center_faces
+
+
+def get_near_faces(faces, centers):
+    """
+    finds the face in faces nearest to each of centers
+    inputs:
+        faces: list of BMFaces
+        centers: list of (x, y, z) cordinates
+    output:
+        list of BMFaces, one for each of centers
+    """
+    # find center of each face
+    face_centers = [f.calc_center_median() for f in faces]
+    fc_tree = mathutils.kdtree.KDTree(len(face_centers))
+    for i, center in enumerate(face_centers):
+        fc_tree.insert(center, i)
+    fc_tree.balance()
+    return [faces[fc_tree.find(v)[1]] for v in centers]
 
 
 def get_near_edges(bm, centers):
@@ -267,7 +629,7 @@ def get_near_edges(bm, centers):
         bm: the bmesh for the whole mesh
         centers: list of (x, y, z) cordinates of link centers
     output:
-        list of BMEdges
+        list of BMEdges, in the order of centers
     this is used if offset == 0 to only select edges
     it needs to be done this way so execute dosen't have to recreate maze_path
     on every parameter change - should be faster
@@ -285,7 +647,7 @@ def get_near_edges(bm, centers):
         ec_tree.insert(center, i)
     ec_tree.balance()
     path_edge_ids = [ec_tree.find(e)[1] for e in centers]
-    path_edges = list({bm.edges[id] for id in path_edge_ids})
+    path_edges = list(dict.fromkeys(bm.edges[id] for id in path_edge_ids))
     return path_edges
 
 
@@ -296,6 +658,7 @@ def do_braid(maze_path, maze_verts, braid_amount=1.0):
     them all.
     Linking dead ends produces loops in the maze.
     Prefer to link to another dead end if possible
+    Dead ends with no unlinked neighbour in the maze are left as they are
     """
     # find all the verts that only have one neighbor in **maze**
     ends = [vert
@@ -318,8 +681,9 @@ def do_braid(maze_path, maze_verts, braid_amount=1.0):
 
             if len(best) == 0:
                 best = unlinked
-            edge = random.choice(best)
-            braid_links.append(edge)
+            if len(best) > 0:
+                edge = random.choice(best)
+                braid_links.append(edge)
 
     return braid_links
 
@@ -4,6 +4,8 @@ import mesh_maze.mesh_maze as mm
 import bmesh
 import bpy
 
+import math
+import random
 import unittest
 
 def put_to_scene(bm):
@@ -39,6 +41,45 @@ def make_edge_selection_grid(bm):
     return bm
 
 
+def bevel_maze(bm):
+    """
+    carve a maze on the selection of bm and bevel it
+    returns the bevel faces and the maze centers
+    """
+    sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+    random.seed(0)
+    maze_path, maze_verts = mm.recursive_back_tracker_maze(inner_edges, False)
+    link_centers, vert_centers = mm.get_maze_centers(maze_path, maze_verts)
+    bevel_faces = bmesh.ops.bevel(
+        bm, geom=sel_geom, offset=0.1, offset_type='OFFSET',
+        segments=1, profile=0.5, affect='EDGES')['faces']
+    return bevel_faces, link_centers + vert_centers
+
+
+def region_extend_wall_faces(bm, bevel_faces, path_faces, boundary_type):
+    """
+    wall faces as selected with bmesh.ops.region_extend before the
+    single pass classifier in get_maze_faces, used as a reference
+    """
+    thin_wall = bmesh.ops.region_extend(
+        bm, geom=path_faces,
+        use_faces=True,
+        use_face_step=True,
+        use_contract=False)['geom']
+    if boundary_type == 1:
+        return set(thin_wall)
+    if boundary_type == 0:
+        return set(bevel_faces + thin_wall) - set(path_faces)
+    test_geom = bmesh.ops.region_extend(
+        bm,
+        geom=thin_wall + path_faces,
+        use_faces=True,
+        use_face_step=True,
+        use_contract=True)['geom']
+    boundary_faces = [f for f in thin_wall for v in f.verts if v.is_boundary]
+    return set(thin_wall) - set(test_geom) - set(boundary_faces)
+
+
 class TestMeshMaze(unittest.TestCase):
 
     def test_module_available(self):
@@ -146,6 +187,344 @@ class TestMeshMaze(unittest.TestCase):
         self.assertEqual(sum(face.select for face in bm.faces), 323)
         bm.free()
 
+    def test_get_maze_faces_boundary_types(self):
+        """
+        wall faces match the region_extend based selection for every
+        boundary type, on a full and a part selected grid
+        """
+        for select_all in [True, False]:
+            bm = bmesh.new()
+            bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+            for face in bm.faces:
+                face.select = select_all or face.verts[0].co[1] > 0.0
+
+            bevel_faces, maze_centers = bevel_maze(bm)
+            walls = {}
+            for boundary_type in [0, 1, 2]:
+                path_faces, wall_faces, center_faces = mm.get_maze_faces(
+                    bm, bevel_faces, maze_centers, boundary_type)
+                self.assertEqual(len(center_faces), len(maze_centers))
+                self.assertEqual(set(center_faces), set(path_faces))
+                self.assertEqual(len(wall_faces), len(set(wall_faces)))
+                self.assertFalse(set(wall_faces) & set(path_faces))
+                self.assertEqual(
+                    set(wall_faces),
+                    region_extend_wall_faces(bm, bevel_faces, path_faces,
+                                             boundary_type))
+                walls[boundary_type] = set(wall_faces)
+
+            self.assertTrue(walls[2] <= walls[1] <= walls[0])
+            bm.free()
+
+    def test_recursive_back_tracker_steps(self):
+        """
+        steps replay the same maze as recursive_back_tracker_maze
+        """
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+
+        random.seed(3)
+        maze_path, maze_verts = mm.recursive_back_tracker_maze(inner_edges)
+        random.seed(3)
+        steps = list(mm.recursive_back_tracker_steps(inner_edges))
+
+        self.assertEqual(steps[0][0], 'START')
+        self.assertEqual([edge for step, edge, vert in steps if step == 'LINK'],
+                         maze_path)
+        # every vert is pushed on the stack once and popped once
+        self.assertEqual(sum(step == 'BACKTRACK' for step, edge, vert in steps),
+                         len(maze_verts))
+        bm.free()
+
+    def test_set_carve_order(self):
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+        random.seed(0)
+        maze_path, maze_verts = mm.recursive_back_tracker_maze(inner_edges)
+
+        layer = mm.set_carve_order(bm, maze_path)
+
+        self.assertEqual([edge[layer] for edge in maze_path],
+                         list(range(len(maze_path))))
+        self.assertEqual(sum(edge[layer] == -1 for edge in bm.edges),
+                         len(bm.edges) - len(maze_path))
+        bm.free()
+
+    def test_generate_maze_carve_order(self):
+        """
+        carve order layer is written to the path faces when bevelled and
+        to the path edges when offset is zero
+        """
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['carve_order'] = True
+        bm, maze_links, maze_verts = mm.generate_maze(bm, maze_params)
+
+        layer = bm.faces.layers.int.get('carve_order')
+        path_orders = [face[layer] for face in bm.faces if face.select]
+        self.assertEqual(len(path_orders), 127)
+        self.assertEqual(min(path_orders), 0)
+        self.assertEqual(max(path_orders), len(maze_links) - 1)
+        self.assertTrue(all(face[layer] == -1
+                            for face in bm.faces if not face.select))
+        bm.free()
+
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        maze_params['offset'] = 0.0
+        bm, maze_links, maze_verts = mm.generate_maze(bm, maze_params)
+
+        layer = bm.edges.layers.int.get('carve_order')
+        self.assertEqual(sorted(edge[layer] for edge in bm.edges if edge.select),
+                         list(range(len(maze_links))))
+        bm.free()
+
+    def test_hierarchical_maze_grid(self):
+        """
+        coarse maze projected onto the grid is still a perfect maze
+        """
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+        inner_verts = {v for e in inner_edges for v in e.verts}
+
+        clusters, vert_cluster, parent_edges = mm.get_vert_clusters(inner_edges, 0.5)
+        self.assertLess(len(clusters), len(inner_verts))
+        self.assertEqual(sum(len(c) for c in clusters), len(inner_verts))
+
+        random.seed(0)
+        maze_path, maze_verts = mm.hierarchical_maze(inner_edges, 0.5)
+        self.assertEqual(len(maze_path), len(set(maze_path)))
+        self.assertEqual(len(maze_path), len(maze_verts) - 1)
+        self.assertTrue({v for e in maze_path for v in e.verts} <= set(maze_verts))
+        self.assertTrue(set(maze_verts) <= inner_verts)
+        bm.free()
+
+    def test_hierarchical_maze_one_cluster(self):
+        """
+        cell size larger than the selection falls back to the full maze
+        """
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+
+        clusters, vert_cluster, parent_edges = mm.get_vert_clusters(inner_edges, 10.0)
+        self.assertEqual(len(clusters), 1)
+
+        random.seed(0)
+        maze = mm.hierarchical_maze(inner_edges, 10.0)
+        random.seed(0)
+        self.assertEqual(maze, mm.recursive_back_tracker_maze(inner_edges))
+        self.assertEqual(len(maze[0]), 63)
+        bm.free()
+
+    def test_generate_maze_hierarchical_braid(self):
+        """
+        braiding a coarse maze leaves alone the dead ends with nothing to link to
+        """
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['cell_size'] = 0.5
+        maze_params['braid'] = 1.0
+        maze_params['offset'] = 0.0
+        for rseed in range(5):
+            bm = bmesh.new()
+            bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+            for face in bm.faces:
+                face.select = True
+            maze_params['rseed'] = rseed
+            bm, maze_links, maze_verts = mm.generate_maze(bm, maze_params)
+
+            self.assertGreaterEqual(len(maze_links), len(maze_verts) - 1)
+            self.assertEqual(sum(edge.select for edge in bm.edges), len(maze_links))
+            bm.free()
+
+    def test_recursive_back_tracker_cells(self):
+        """
+        the step generator works on a graph of cells
+        """
+        # 3 x 3 grid of cells
+        cell_nghbrs = {
+            i: [j for j in range(9)
+                if abs(i % 3 - j % 3) + abs(i // 3 - j // 3) == 1]
+            for i in range(9)
+        }
+        random.seed(0)
+        steps = list(mm.recursive_back_tracker_cells(cell_nghbrs))
+        cell_path = [link for step, link, cell in steps if step == 'LINK']
+
+        self.assertEqual(steps[0][0], 'START')
+        self.assertEqual(len(cell_path), 8)
+        self.assertEqual(sum(step == 'BACKTRACK' for step, link, cell in steps), 9)
+        self.assertTrue(all(b in cell_nghbrs[a] for a, b in cell_path))
+
+    def test_weighted_kruskal_maze_grid(self):
+        """
+        weighted maze is a perfect maze and a direction weight
+        carves mostly along that axis
+        """
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['weight_type'] = "DIRECTION"
+        maze_params['weight_axis'] = 0
+        maze_params['weight_bias'] = 5.0
+        weights = mm.get_edge_weights(bm, inner_edges, maze_params)
+        self.assertEqual(len(weights), len(inner_edges))
+
+        random.seed(0)
+        maze_path, maze_verts = mm.weighted_kruskal_maze(inner_edges, weights)
+        self.assertEqual(len(maze_path), 63)
+        self.assertEqual(len(maze_verts), 64)
+        x_links = sum(abs(e.verts[0].co[1] - e.verts[1].co[1]) < 0.001
+                      for e in maze_path)
+        self.assertGreater(x_links, len(maze_path) / 2)
+        bm.free()
+
+    def test_get_edge_weights_vertex_group(self):
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        deform = bm.verts.layers.deform.verify()
+        for vert in bm.verts:
+            if vert.co[0] > 0.0:
+                vert[deform][0] = 1.0
+
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['weight_type'] = "VERTEX_GROUP"
+        maze_params['weight_group'] = 0
+        weights = mm.get_edge_weights(bm, bm.edges, maze_params)
+        for edge, weight in zip(bm.edges, weights):
+            value = sum(v.co[0] > 0.0 for v in edge.verts) / 2
+            self.assertAlmostEqual(weight, math.exp(2.0 * value))
+
+        # no group gives uniform weights
+        maze_params['weight_group'] = -1
+        weights = mm.get_edge_weights(bm, bm.edges, maze_params)
+        self.assertEqual(weights, [1.0] * len(bm.edges))
+        bm.free()
+
+    def test_get_edge_weights_attribute(self):
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        edge_layer = bm.edges.layers.float.new('edge_weight')
+        for edge, value in zip(bm.edges, [0.5, 2.0, -1.0]):
+            edge[edge_layer] = value
+        vert_layer = bm.verts.layers.float.new('vert_weight')
+        bm.verts.ensure_lookup_table()
+        bm.verts[0][vert_layer] = 1.0
+
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['weight_type'] = "ATTRIBUTE"
+        maze_params['weight_name'] = 'edge_weight'
+        weights = mm.get_edge_weights(bm, bm.edges, maze_params)
+        # values are clamped between 0 and 1
+        self.assertAlmostEqual(weights[0], math.exp(1.0))
+        self.assertAlmostEqual(weights[1], math.exp(2.0))
+        self.assertAlmostEqual(weights[2], 1.0)
+
+        maze_params['weight_name'] = 'vert_weight'
+        weights = mm.get_edge_weights(bm, bm.edges, maze_params)
+        for edge, weight in zip(bm.edges, weights):
+            if bm.verts[0] in edge.verts:
+                self.assertAlmostEqual(weight, math.exp(1.0))
+            else:
+                self.assertAlmostEqual(weight, 1.0)
+
+        maze_params['weight_name'] = 'missing'
+        weights = mm.get_edge_weights(bm, bm.edges, maze_params)
+        self.assertEqual(weights, [1.0] * len(bm.edges))
+        bm.free()
+
+    def test_get_edge_weights_extreme_bias(self):
+        """
+        extreme bias is clamped so weights stay finite and positive
+        and can still be carved
+        """
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['weight_type'] = "DIRECTION"
+        maze_params['weight_axis'] = 0
+        for bias in [1000.0, -1000.0]:
+            maze_params['weight_bias'] = bias
+            weights = mm.get_edge_weights(bm, inner_edges, maze_params)
+            self.assertTrue(all(0.0 < w < float('inf') for w in weights))
+            self.assertAlmostEqual(math.log(max(weights) / min(weights)), 50.0)
+            maze_path, maze_verts = mm.weighted_kruskal_maze(inner_edges, weights)
+            self.assertEqual(len(maze_path), 63)
+        bm.free()
+
+    def test_get_edge_weights_angle(self):
+        bm = bmesh.new()
+        bmesh.ops.create_cube(bm, size=2.0)
+
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['weight_type'] = "ANGLE"
+        weights = mm.get_edge_weights(bm, bm.edges, maze_params)
+        # every cube edge has a right angle between its faces
+        for weight in weights:
+            self.assertAlmostEqual(weight, math.exp(2.0 * 0.5))
+        bm.free()
+
+    def test_weighted_kruskal_maze_small_weights(self):
+        """
+        very small weights still give a random maze
+        """
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+        sel_geom, inner_edges = mm.get_inner_edges(bm, 1)
+        weights = [math.exp(-10.0)] * len(inner_edges)
+
+        mazes = []
+        for rseed in range(2):
+            random.seed(rseed)
+            maze_path, maze_verts = mm.weighted_kruskal_maze(inner_edges, weights)
+            self.assertEqual(len(maze_path), 63)
+            mazes.append(set(maze_path))
+        self.assertNotEqual(mazes[0], mazes[1])
+        bm.free()
+
+    def test_generate_maze_weighted(self):
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=10, y_segments=10, size=1.0)
+        for face in bm.faces:
+            face.select = True
+
+        maze_params = mm.MAZE_PARAMS.copy()
+        maze_params['weight_type'] = "DIRECTION"
+        maze_params['weight_axis'] = 1
+        maze_params['offset'] = 0.0
+        bm, maze_links, maze_verts = mm.generate_maze(bm, maze_params)
+
+        self.assertEqual(len(maze_links), 63)
+        self.assertEqual(len(maze_verts), 64)
+        self.assertEqual(sum(edge.select for edge in bm.edges), 63)
+        bm.free()
+
 
 if __name__ == "__main__":
     unittest.main(exit=False, verbosity=2)